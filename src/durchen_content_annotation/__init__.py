@@ -1,14 +1,20 @@
 """Durchen annotation in content package."""
 
 from .annotation import (
+    Segment,
+    clear_cache,
     insert_durchen_tags,
     get_segment_with_tags,
     get_all_segments_with_tags,
+    iter_all_segments_with_tags,
 )
 
 __all__ = [
+    "Segment",
+    "clear_cache",
     "insert_durchen_tags",
     "get_segment_with_tags",
     "get_all_segments_with_tags",
+    "iter_all_segments_with_tags",
 ]
 
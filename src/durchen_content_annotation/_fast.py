@@ -0,0 +1,78 @@
+"""Optional Numba-compiled helpers for locating tags on very large inputs."""
+
+from bisect import bisect_right
+from typing import Any, List, Optional, Sequence, Tuple
+
+# Below this many segments the array conversion costs more than it saves
+NUMBA_MIN_SEGMENTS = 10000
+
+# Compiled kernel, loaded on first large input; False once numba is known to be missing
+_kernel: Any = None
+
+
+def _load_kernel() -> Optional[Any]:
+    """
+    Import numba and compile the range kernel on first use.
+
+    Deferring the import keeps numba and numpy out of package import time.
+
+    Returns:
+        The compiled kernel, or None if numba is not installed.
+    """
+    global _kernel
+    if _kernel is None:
+        try:
+            import numpy as np
+            from numba import njit
+        except ImportError:
+            _kernel = False
+        else:
+            @njit(cache=True)
+            def find_ranges_kernel(positions, starts, ends):
+                lo = np.empty_like(starts)
+                hi = np.empty_like(ends)
+                for i in range(starts.size):
+                    lo[i] = np.searchsorted(positions, starts[i], side='right')
+                    hi[i] = np.searchsorted(positions, ends[i], side='right')
+                return lo, hi
+
+            _kernel = find_ranges_kernel
+    return _kernel or None
+
+
+def find_ranges(
+    positions: Sequence[int],
+    starts: Sequence[int],
+    ends: Sequence[int]
+) -> Tuple[List[int], List[int]]:
+    """
+    Find the range of tag indices falling inside each segment.
+
+    Only integer index ranges are computed here; building the segment strings
+    stays in pure Python. Uses Numba when it is installed and the input is
+    large enough, otherwise falls back to bisect.
+
+    Args:
+        positions: Tag positions, sorted ascending
+        starts: Start index of each segment (exclusive)
+        ends: End index of each segment (inclusive)
+
+    Returns:
+        Tuple of (lo, hi) lists so that tags positions[lo[i]:hi[i]] fall
+        within (starts[i], ends[i]].
+    """
+    if len(starts) >= NUMBA_MIN_SEGMENTS:
+        kernel = _load_kernel()
+        if kernel is not None:
+            import numpy as np
+
+            lo, hi = kernel(
+                np.asarray(positions, dtype=np.int64),
+                np.asarray(starts, dtype=np.int64),
+                np.asarray(ends, dtype=np.int64),
+            )
+            return lo.tolist(), hi.tolist()
+
+    lo = [bisect_right(positions, start) for start in starts]
+    hi = [bisect_right(positions, end) for end in ends]
+    return lo, hi
@@ -1,16 +1,49 @@
 """Functions for inserting durchen annotations into text content."""
 
-import re
-from typing import List, Dict, Any
+import bisect
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from html import escape
+from operator import itemgetter
+from typing import Iterator, List, Dict, Any, Optional, Sequence, Tuple
+
+from ._fast import find_ranges
+
+# Literal prefix/suffix of the footnote marker wrapped around each note
+_PRE = '<sup class="footnote-marker"></sup><i class="footnote">'
+_POST = '</i>'
+
+# Tag position map of the most recent durchen list, keyed by
+# (id(durchen_annotation), len(durchen_annotation)). The entry also keeps the
+# list itself so its id cannot be reused while cached. Only one entry is kept
+# so at most one input stays alive.
+_cache: Dict[Tuple[int, int], Tuple[List[Dict[str, Any]], Tuple[Tuple[int, ...], Tuple[str, ...]]]] = {}
+
+
+@dataclass
+class Segment:
+    """A segment of the original text with durchen tags included.
+    
+    Uses __slots__ to keep per-segment memory low on large corpora.
+    """
+    __slots__ = ("id", "content")
+    
+    id: str
+    content: str
+    
+    def to_dict(self) -> Dict[str, str]:
+        """Return the segment as a JSON-serializable dict."""
+        return {"id": self.id, "content": self.content}
 
 
 def insert_durchen_tags(text: str, durchen_annotation: List[Dict[str, Any]]) -> str:
     """
     Insert durchen note tags into text at segment end positions.
     
-    All tags are inserted simultaneously using original indices to avoid
-    index shifting issues. Tags are inserted in descending order of end
-    positions to maintain correct indices.
+    All tags are inserted in a single pass over the text using original
+    indices, so no index shifting happens. The text slices and tags are
+    collected in order and joined once at the end.
     
     Args:
         text: Original text content
@@ -22,6 +55,10 @@ def insert_durchen_tags(text: str, durchen_annotation: List[Dict[str, Any]]) ->
         Text with durchen tags inserted at appropriate positions.
         Tags are formatted as <note_content>.
     
+    The markers built from durchen_annotation are cached for the most recent
+    list. Call clear_cache() after editing that list in place without
+    changing its length, otherwise stale markers are returned.
+    
     Example:
         >>> text = "I have a dream"
         >>> durchen_data = [{"span": {"start": 0, "end": 10}, "note": "A is good"}]
@@ -31,18 +68,23 @@ def insert_durchen_tags(text: str, durchen_annotation: List[Dict[str, Any]]) ->
     # Build tag position map using helper function
     tag_position_map = _build_tag_position_map_from_durchen(durchen_annotation)
     
-    # Insert tags starting from the end (descending order) to avoid index shifting
-    # Reverse the list since tag_position_map is sorted in ascending order
-    annotated_text = text
-    for tag_info in reversed(tag_position_map):
-        end_index = tag_info['original_pos']
-        tag = tag_info['tag']
-        annotated_text = annotated_text[:end_index] + tag + annotated_text[end_index:]
+    # Walk the text once in ascending order, collecting slices and tags
+    positions, tags = tag_position_map
+    parts = []
+    prev = 0
+    for i in range(len(positions)):
+        end_index = positions[i]
+        parts.append(text[prev:end_index])
+        parts.append(tags[i])
+        prev = end_index
+    parts.append(text[prev:])
     
-    return annotated_text
+    return ''.join(parts)
 
 
-def _build_tag_position_map_from_durchen(durchen_annotation: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+def _build_tag_position_map_from_durchen(
+    durchen_annotation: List[Dict[str, Any]]
+) -> Tuple[Tuple[int, ...], Tuple[str, ...]]:
     """
     Build tag position map directly from durchen_data.
     
@@ -54,87 +96,343 @@ def _build_tag_position_map_from_durchen(durchen_annotation: List[Dict[str, Any]
             - span: dict with 'start' and 'end' keys
             - note: string containing the note content
     
+    Notes are HTML-escaped once here, so the markers can be spliced into
+    segments without further sanitizing.
+    
     Returns:
-        List of dictionaries with 'tag' and 'original_pos' keys, sorted by original_pos.
+        Tuple of two parallel tuples (positions, tags): positions holds each
+        tag's original_pos sorted ascending, tags holds the matching marker.
+        The result is cached for the most recent list; call clear_cache()
+        after modifying that list in place.
     """
-    tag_position_map = []
-    for item in durchen_annotation:
-        end_index = item["span"]["end"]
-        note = item["note"]
-        marker = f"<sup class='footnote-marker'></sup><i class='footnote'>{note}</i>"
-
-        tag_position_map.append({
-            'tag': marker,
-            'original_pos': end_index,
-        })
+    key = (id(durchen_annotation), len(durchen_annotation))
+    cached = _cache.get(key)
+    if cached is not None and cached[0] is durchen_annotation:
+        return cached[1]
     
-    # Sort by original_pos
-    tag_position_map.sort(key=lambda x: x['original_pos'])
+    # Sort by original_pos (stable, so notes sharing a position keep their order)
+    pairs = sorted(
+        (
+            (item["span"]["end"], ''.join((_PRE, escape(item["note"], quote=False), _POST)))
+            for item in durchen_annotation
+        ),
+        key=itemgetter(0),
+    )
+    positions: Tuple[int, ...] = tuple(pos for pos, _ in pairs)
+    tags: Tuple[str, ...] = tuple(tag for _, tag in pairs)
+    
+    tag_position_map = (positions, tags)
+    _cache.clear()
+    _cache[key] = (durchen_annotation, tag_position_map)
     return tag_position_map
 
 
+def clear_cache() -> None:
+    """Clear cached tag position maps built from durchen annotations."""
+    _cache.clear()
+
+
 def get_segment_with_tags(
     original_text: str,
-    tag_position_map: List[Dict[str, Any]],
+    tag_position_map: Tuple[Sequence[int], Sequence[str]],
     start: int,
     end: int
 ) -> str:
     """
     Extract a segment using pre-computed tag position map (optimized for multiple segments).
     
-    This function is used internally by get_all_segments_with_tags() to avoid
-    recomputing tag positions for each segment.
+    The tag position map is built once and can be reused across many calls,
+    avoiding recomputing tag positions for each segment.
     
     Args:
         original_text: Original text without tags
-        tag_position_map: Pre-computed list of tag positions from _build_tag_position_map()
+        tag_position_map: Pre-computed (positions, tags) sequences from
+            _build_tag_position_map_from_durchen()
         start: Start index of the segment (in original text)
         end: End index of the segment (in original text)
     
     Returns:
         Segment content with durchen tags included at their relative positions.
+    
+    Raises:
+        ValueError: If start is greater than end.
     """
-    original_segment = original_text[start:end]
+    if start > end:
+        raise ValueError(f"Segment start {start} is greater than end {end}")
+    
+    positions, tags = tag_position_map
     
-    # Filter tags that fall within (start, end] range
+    # Binary search for tags that fall within (start, end] range
     # Note: start is exclusive, end is inclusive
-    relevant_tags = [
-        tag_info for tag_info in tag_position_map
-        if start < tag_info['original_pos'] <= end
-    ]
+    lo = bisect.bisect_right(positions, start)
+    hi = bisect.bisect_right(positions, end)
     
-    if not relevant_tags:
-        return original_segment
+    return _join_segment(original_text, positions, tags, start, end, lo, hi)
+
+
+def _join_segment(
+    original_text: str,
+    positions: Sequence[int],
+    tags: Sequence[str],
+    start: int,
+    end: int,
+    lo: int,
+    hi: int
+) -> str:
+    """
+    Build segment content from original_text and the tags at indices [lo, hi).
     
-    # Build result using list
-    result_parts = []
-    current_pos = 0
+    Assumes start <= end (validated by callers) and ascending positions
+    (guaranteed by _build_tag_position_map_from_durchen()).
     
-    for tag_info in relevant_tags:
-        relative_pos = tag_info['original_pos'] - start
+    Args:
+        original_text: Original text without tags
+        positions: Tag positions, sorted ascending
+        tags: Tag strings parallel to positions
+        start: Start index of the segment (in original text)
+        end: End index of the segment (in original text)
+        lo: Index of the first tag inside the segment
+        hi: Index one past the last tag inside the segment
+    
+    Returns:
+        Segment content with the given tags inserted.
+    """
+    # Most segments hold zero or one tag; avoid building a list for those
+    if lo == hi:
+        return original_text[start:end]
+    if hi - lo == 1:
+        pos = positions[lo]
+        return original_text[start:pos] + tags[lo] + original_text[pos:end]
+    
+    # Build result in a preallocated list (text, tag, text, ..., tag, text),
+    # slicing original_text at absolute offsets
+    n = hi - lo
+    result_parts: List[str] = [""] * (2 * n + 1)
+    last = start
+    
+    for k in range(n):
+        pos = positions[lo + k]
+        result_parts[2 * k] = original_text[last:pos]
+        result_parts[2 * k + 1] = tags[lo + k]
+        last = pos
+    
+    result_parts[2 * n] = original_text[last:end]
+    
+    return ''.join(result_parts)
+
+
+def _spans_are_sorted_and_disjoint(segments: List[Tuple[Any, int, int]]) -> bool:
+    """
+    Check whether segments are ordered by position without overlapping.
+    
+    Args:
+        segments: List of (id, start, end) tuples.
+    
+    Returns:
+        True if every segment starts at or after the end of all previous segments.
+    """
+    # Spans are validated to have start <= end, so ends only grow while sorted
+    prev_end = None
+    for _, start, end in segments:
+        if prev_end is not None and start < prev_end:
+            return False
+        prev_end = end
+    return True
+
+
+def _iter_contents(
+    original_text: str,
+    positions: Sequence[int],
+    tags: Sequence[str],
+    segments: List[Tuple[Any, int, int]]
+) -> Iterator[str]:
+    """
+    Yield the tagged content of each flattened (id, start, end) segment.
+    
+    When segments are sorted and non-overlapping (the usual case), tags and
+    segments are walked together in a single merge pass. Otherwise each
+    segment's tag range is found by binary search (Numba-compiled when
+    available, see _fast.find_ranges()).
+    
+    Args:
+        original_text: Original text without tags
+        positions: Tag positions, sorted ascending
+        tags: Tag strings parallel to positions
+        segments: List of (id, start, end) tuples
+    
+    Yields:
+        Segment content strings in the order of segments.
+    """
+    if not _spans_are_sorted_and_disjoint(segments):
+        lows, highs = find_ranges(
+            positions,
+            [start for _, start, _ in segments],
+            [end for _, _, end in segments],
+        )
+        for (_, start, end), lo, hi in zip(segments, lows, highs):
+            yield _join_segment(original_text, positions, tags, start, end, lo, hi)
+        return
+    
+    # Merge pass: each tag is visited once across all segments
+    num_tags = len(positions)
+    ti = bisect.bisect_right(positions, segments[0][1]) if segments else 0
+    
+    for _, start, end in segments:
+        # Skip tags at or before segment start (start is exclusive)
+        while ti < num_tags and positions[ti] <= start:
+            ti += 1
+        lo = ti
         
-        if relative_pos > current_pos:
-            result_parts.append(original_segment[current_pos:relative_pos])
+        # Advance past tags within (start, end]
+        while ti < num_tags and positions[ti] <= end:
+            ti += 1
         
-        result_parts.append(tag_info['tag'])
-        current_pos = relative_pos
+        yield _join_segment(original_text, positions, tags, start, end, lo, ti)
+
+
+def _iter_segments(
+    original_text: str,
+    positions: Sequence[int],
+    tags: Sequence[str],
+    segments: List[Tuple[Any, int, int]]
+) -> Iterator[Segment]:
+    """
+    Yield Segment objects for flattened (id, start, end) segments.
     
-    if current_pos < len(original_segment):
-        result_parts.append(original_segment[current_pos:])
+    Args:
+        original_text: Original text without tags
+        positions: Tag positions, sorted ascending
+        tags: Tag strings parallel to positions
+        segments: List of (id, start, end) tuples
     
-    return ''.join(result_parts)
+    Yields:
+        Segment objects in the order of segments.
+    """
+    contents = _iter_contents(original_text, positions, tags, segments)
+    for (segment_id, _, _), content in zip(segments, contents):
+        yield Segment(segment_id, content)
 
 
-def get_all_segments_with_tags(
+def _prepare(
+    segmentation_annotation: List[Dict[str, Any]],
+    durchen_annotation: Optional[List[Dict[str, Any]]]
+) -> Tuple[Sequence[int], Sequence[str], List[Tuple[Any, int, int]]]:
+    """
+    Build the tag position map and flatten segments to (id, start, end) tuples.
+    
+    Args:
+        segmentation_annotation: List of segmentation objects with 'id' and 'span'.
+        durchen_annotation: Optional list of durchen annotation objects.
+    
+    Returns:
+        Tuple of (positions, tags, segments).
+    
+    Raises:
+        ValueError: If a segment's start is greater than its end.
+    """
+    # Build tag position map once (cached for reuse)
+    if durchen_annotation is not None:
+        positions, tags = _build_tag_position_map_from_durchen(durchen_annotation)
+    else:
+        positions, tags = (), ()
+    
+    # Flatten segments to (id, start, end) once to avoid nested dict lookups
+    segments = [
+        (segment["id"], segment["span"]["start"], segment["span"]["end"])
+        for segment in segmentation_annotation
+    ]
+    for segment_id, start, end in segments:
+        if start > end:
+            raise ValueError(f"Segment {segment_id} start {start} is greater than end {end}")
+    return positions, tags, segments
+
+
+# Below this many segments a process pool's startup cost outweighs any gain
+PARALLEL_MIN_SEGMENTS = 100000
+
+# State shared with worker processes, set once per worker by _init_worker()
+_worker_state: Dict[str, Any] = {}
+
+
+def _init_worker(
+    original_text: str,
+    positions: Sequence[int],
+    tags: Sequence[str],
+    segments: List[Tuple[Any, int, int]]
+) -> None:
+    """Store read-only inputs in a worker process (inherited, not pickled, under fork)."""
+    _worker_state["original_text"] = original_text
+    _worker_state["positions"] = positions
+    _worker_state["tags"] = tags
+    _worker_state["segments"] = segments
+
+
+def _segments_chunk(chunk_start: int, chunk_end: int) -> List[str]:
+    """Build contents of segments[chunk_start:chunk_end] in a worker process.
+    
+    Only the content strings are returned; the parent already has the ids,
+    so there is no need to pickle Segment objects back.
+    """
+    return list(_iter_contents(
+        _worker_state["original_text"],
+        _worker_state["positions"],
+        _worker_state["tags"],
+        _worker_state["segments"][chunk_start:chunk_end],
+    ))
+
+
+def iter_all_segments_with_tags(
     original_text: str,
     segmentation_annotation: List[Dict[str, Any]],
     durchen_annotation: List[Dict[str, Any]] = None
-) -> List[Dict[str, Any]]:
+) -> Iterator[Segment]:
+    """
+    Yield segments from segmentation data with durchen tags included, one at a time.
+    
+    Builds the tag position map once and reuses it for all segments. Segments
+    are produced lazily so callers can stream them (e.g. to a JSON file)
+    without holding the whole result in memory.
+    
+    Args:
+        original_text: Original text without tags
+        segmentation_data: List of segmentation objects, each containing:
+            - id: segment identifier
+            - span: dict with 'start' and 'end' keys
+        durchen_data: Optional list of durchen annotation objects.
+    
+    Yields:
+        Segment objects with 'id' and 'content' fields, in the order of
+        segmentation_data.
+    
+    The markers built from durchen_annotation are cached for the most recent
+    list. Call clear_cache() after editing that list in place without
+    changing its length, otherwise stale markers are returned.
+    """
+    positions, tags, segments = _prepare(segmentation_annotation, durchen_annotation)
+    return _iter_segments(original_text, positions, tags, segments)
+
+
+def get_all_segments_with_tags(
+    original_text: str,
+    segmentation_annotation: List[Dict[str, Any]],
+    durchen_annotation: List[Dict[str, Any]] = None,
+    workers: int = 1
+) -> List[Segment]:
     """
     Extract all segments from segmentation data with durchen tags included.
     
     Optimized version that builds tag position map once and reuses it for all segments.
-    If durchen_data is provided, uses direct data access instead of parsing annotated_text.
+    See iter_all_segments_with_tags() for a streaming variant.
+    
+    With workers > 1 and at least PARALLEL_MIN_SEGMENTS segments, segments
+    are split into equally sized chunks built by a process pool. Workers
+    send back only content strings, which the parent pairs with segment
+    ids. On POSIX the pool uses the fork start method so the text, tags and
+    segments are inherited by workers; elsewhere they are pickled to every
+    worker, which makes the pool much less attractive. Smaller inputs are
+    always built in-process. The parent still unpickles every string and
+    pairs it with its id, which on large inputs costs close to the whole
+    in-process build, so measure before relying on workers > 1.
     
     Args:
         original_text: Original text without tags
@@ -143,36 +441,40 @@ def get_all_segments_with_tags(
             - span: dict with 'start' and 'end' keys
         durchen_data: Optional list of durchen annotation objects. If provided, uses
             this instead of parsing annotated_text for better performance.
+        workers: Number of worker processes. Defaults to 1 (no pool).
     
     Returns:
-        List of segment dictionaries with added 'content' field containing
-        the segment text with durchen tags included.
+        List of Segment objects whose 'content' field holds the segment
+        text with durchen tags included.
+    
+    The markers built from durchen_annotation are cached for the most recent
+    list. Call clear_cache() after editing that list in place without
+    changing its length, otherwise stale markers are returned.
     """
-    # Build tag position map once (cached for reuse)
-    # Use durchen_data if provided for better performance
-    if durchen_annotation is not None:
-        tag_position_map = _build_tag_position_map_from_durchen(durchen_annotation)
-   
+    positions, tags, segments = _prepare(segmentation_annotation, durchen_annotation)
     
-    segments_with_tags = []
+    workers = min(workers, len(segments))
+    if workers <= 1 or len(segments) < PARALLEL_MIN_SEGMENTS:
+        return list(_iter_segments(original_text, positions, tags, segments))
     
-    for segment in segmentation_annotation:
-        span = segment["span"]
-        start = span["start"]
-        end = span["end"]
-        
-        # Extract segment content with tags using cached tag map
-        content = get_segment_with_tags(
-            original_text, tag_position_map, start, end
-        )
-        
-        # Create new segment dict with content
-        segment_with_content = {
-            "id": segment["id"],
-            "content": content
-        }
-        
-        segments_with_tags.append(segment_with_content)
+    # Fork lets workers inherit the read-only inputs instead of unpickling them
+    start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+    mp_context = multiprocessing.get_context(start_method)
     
-    return segments_with_tags
-
+    chunk_size = -(-len(segments) // workers)
+    chunk_starts = range(0, len(segments), chunk_size)
+    chunk_ends = [chunk_start + chunk_size for chunk_start in chunk_starts]
+    
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=mp_context,
+        initializer=_init_worker,
+        initargs=(original_text, positions, tags, segments),
+    ) as executor:
+        chunks = executor.map(_segments_chunk, chunk_starts, chunk_ends)
+        contents = [content for chunk in chunks for content in chunk]
+    
+    return [
+        Segment(segment_id, content)
+        for (segment_id, _, _), content in zip(segments, contents)
+    ]
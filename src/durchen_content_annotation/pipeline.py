@@ -2,10 +2,11 @@
 """Script to run durchen annotation functions with data files."""
 
 import json
+import textwrap
 from pathlib import Path
 
 from durchen_content_annotation.annotation import (
-    get_all_segments_with_tags,
+    iter_all_segments_with_tags,
 )
 
 def main():
@@ -28,16 +29,22 @@ def main():
     with open(segmentation_path, 'r', encoding='utf-8') as f:
         segmentation_annotation = json.load(f)["data"]
  
-    segments_with_tags = get_all_segments_with_tags(
+    segments_with_tags = iter_all_segments_with_tags(
         text, segmentation_annotation, durchen_annotation
     )
  
-    # Save results to file (optional)
+    # Stream results to file one segment at a time (same layout as json.dump indent=2)
     output_path = "./data/segments_with_tags.json"
     print(f"\nSaving results to {output_path}...")
+    count = 0
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(segments_with_tags, f, ensure_ascii=False, indent=2)
-    print(f"  ✓ Saved {len(segments_with_tags)} segments to {output_path}")
+        f.write('[')
+        for segment in segments_with_tags:
+            f.write(',\n' if count else '\n')
+            f.write(textwrap.indent(json.dumps(segment.to_dict(), ensure_ascii=False, indent=2), '  '))
+            count += 1
+        f.write('\n]' if count else ']')
+    print(f"  ✓ Saved {count} segments to {output_path}")
     
 if __name__ == "__main__":
     main()
@@ -1,12 +1,22 @@
 """Tests for durchen annotation functionality."""
 
 import re
+
+import pytest
+
 from durchen_content_annotation.annotation import (
     insert_durchen_tags,
     _build_tag_position_map_from_durchen,
+    clear_cache,
     get_segment_with_tags,
-    get_all_segments_with_tags, 
+    get_all_segments_with_tags,
+    iter_all_segments_with_tags,
 )
+from durchen_content_annotation import _fast, annotation
+
+# Matches a whole footnote marker: <sup...></sup><i...>note</i>
+_STRIP_TAGS = re.compile(r'<sup[^>]*></sup><i[^>]*>.*?</i>')
+
 
 def test_insert_durchen_tags():
     """Test inserting durchen tags into text."""
@@ -50,22 +60,64 @@ def test_build_tag_position_map_from_durchen():
         {"span": {"start": 10, "end": 20}, "note": "C"},
     ]
     
-    tag_position_map = _build_tag_position_map_from_durchen(durchen_data)
+    positions, tags = _build_tag_position_map_from_durchen(durchen_data)
     
     # Verify structure
-    assert len(tag_position_map) == 3
+    assert len(positions) == 3
+    assert len(tags) == 3
     
     # Verify sorted by original_pos (ascending)
-    positions = [item['original_pos'] for item in tag_position_map]
-    assert positions == [10, 20, 30]
+    assert positions == (10, 20, 30)
     
     # Verify tags are correct (HTML format)
-    assert tag_position_map[0]['tag'] == '<sup class="footnote-marker"></sup><i class="footnote">A</i>'
-    assert tag_position_map[0]['original_pos'] == 10
-    assert tag_position_map[1]['tag'] == '<sup class="footnote-marker"></sup><i class="footnote">C</i>'
-    assert tag_position_map[1]['original_pos'] == 20
-    assert tag_position_map[2]['tag'] == '<sup class="footnote-marker"></sup><i class="footnote">B</i>'
-    assert tag_position_map[2]['original_pos'] == 30
+    assert tags[0] == '<sup class="footnote-marker"></sup><i class="footnote">A</i>'
+    assert tags[1] == '<sup class="footnote-marker"></sup><i class="footnote">C</i>'
+    assert tags[2] == '<sup class="footnote-marker"></sup><i class="footnote">B</i>'
+
+
+def test_build_tag_position_map_from_durchen_empty():
+    """Test building tag position map from empty durchen_data."""
+    positions, tags = _build_tag_position_map_from_durchen([])
+    
+    assert positions == ()
+    assert tags == ()
+
+
+def test_build_tag_position_map_from_durchen_escapes_notes():
+    """Test that HTML special characters in notes are escaped."""
+    durchen_data = [
+        {"span": {"start": 0, "end": 10}, "note": "<b> & \"c\""},
+    ]
+    
+    _, tags = _build_tag_position_map_from_durchen(durchen_data)
+    
+    assert tags[0] == '<sup class="footnote-marker"></sup><i class="footnote">&lt;b&gt; &amp; "c"</i>'
+
+
+def test_build_tag_position_map_from_durchen_is_cached():
+    """Test that the tag position map is reused for the same durchen list."""
+    durchen_data = [
+        {"span": {"start": 0, "end": 10}, "note": "A"},
+    ]
+    
+    first = _build_tag_position_map_from_durchen(durchen_data)
+    assert _build_tag_position_map_from_durchen(durchen_data) is first
+    
+    # Appending changes the length, so the map is rebuilt
+    durchen_data.append({"span": {"start": 10, "end": 20}, "note": "B"})
+    second = _build_tag_position_map_from_durchen(durchen_data)
+    assert second[0] == (10, 20)
+    
+    # Only the most recent list is kept
+    other = [{"span": {"start": 0, "end": 5}, "note": "D"}]
+    _build_tag_position_map_from_durchen(other)
+    assert _build_tag_position_map_from_durchen(durchen_data) is not second
+    
+    # In-place edits need an explicit clear
+    durchen_data[0]["note"] = "C"
+    clear_cache()
+    positions, tags = _build_tag_position_map_from_durchen(durchen_data)
+    assert tags[0] == '<sup class="footnote-marker"></sup><i class="footnote">C</i>'
 
 
 def test_get_segment_with_tags():
@@ -86,7 +138,7 @@ def test_get_segment_with_tags():
     
     # Verify original content is present (remove all HTML tags and note content for comparison)
     # Remove the entire footnote marker: <sup...></sup><i...>note</i>
-    content_without_tags = re.sub(r'<sup[^>]*></sup><i[^>]*>.*?</i>', '', segment)
+    content_without_tags = _STRIP_TAGS.sub('', segment)
     assert content_without_tags == original_text[0:20]
     
     # Verify tags within range are included (HTML format)
@@ -131,28 +183,29 @@ def test_get_all_segments_with_tags():
     
     # Use durchen_data
     segments = get_all_segments_with_tags(
-        original_text, segmentation_data, durchen_data=durchen_data
+        original_text, segmentation_data, durchen_annotation=durchen_data
     )
     
     # Verify structure
     assert len(segments) == 2
+    assert segments[0].to_dict() == {"id": "seg1", "content": segments[0].content}
     
     # First segment [0, 20] should include tag at position 10
-    assert segments[0]["id"] == "seg1"
-    assert '<sup class="footnote-marker"></sup><i class="footnote">A</i>' in segments[0]["content"]
-    assert '<sup class="footnote-marker"></sup><i class="footnote">B</i>' not in segments[0]["content"]
+    assert segments[0].id == "seg1"
+    assert '<sup class="footnote-marker"></sup><i class="footnote">A</i>' in segments[0].content
+    assert '<sup class="footnote-marker"></sup><i class="footnote">B</i>' not in segments[0].content
     
     # Second segment [20, 40] should include tag at position 30
-    assert segments[1]["id"] == "seg2"
-    assert '<sup class="footnote-marker"></sup><i class="footnote">B</i>' in segments[1]["content"]
-    assert '<sup class="footnote-marker"></sup><i class="footnote">A</i>' not in segments[1]["content"]
+    assert segments[1].id == "seg2"
+    assert '<sup class="footnote-marker"></sup><i class="footnote">B</i>' in segments[1].content
+    assert '<sup class="footnote-marker"></sup><i class="footnote">A</i>' not in segments[1].content
     
     # Verify content includes original text (remove all HTML tags and note content for comparison)
     # Remove the entire footnote marker: <sup...></sup><i...>note</i>
-    content_without_tags_0 = re.sub(r'<sup[^>]*></sup><i[^>]*>.*?</i>', '', segments[0]["content"])
+    content_without_tags_0 = _STRIP_TAGS.sub('', segments[0].content)
     assert content_without_tags_0 == original_text[0:20]
     
-    content_without_tags_1 = re.sub(r'<sup[^>]*></sup><i[^>]*>.*?</i>', '', segments[1]["content"])
+    content_without_tags_1 = _STRIP_TAGS.sub('', segments[1].content)
     assert content_without_tags_1 == original_text[20:40]
 
 
@@ -181,7 +234,7 @@ def test_get_segment_with_tags_excludes_tag_at_start():
     assert '<sup class="footnote-marker"></sup><i class="footnote">Tag at position 10</i>' in segment
     
     # Verify original content is present
-    content_without_tags = re.sub(r'<sup[^>]*></sup><i[^>]*>.*?</i>', '', segment)
+    content_without_tags = _STRIP_TAGS.sub('', segment)
     assert content_without_tags == original_text[0:15]
 
 
@@ -233,7 +286,7 @@ def test_get_segment_with_tags_non_zero_start():
     assert '<sup class="footnote-marker"></sup><i class="footnote">Tag at 20</i>' in segment
     
     # Verify original content is present
-    content_without_tags = re.sub(r'<sup[^>]*></sup><i[^>]*>.*?</i>', '', segment)
+    content_without_tags = _STRIP_TAGS.sub('', segment)
     assert content_without_tags == original_text[10:25]
 
 
@@ -254,16 +307,143 @@ def test_get_all_segments_with_tags_excludes_tags_at_start():
     ]
     
     segments = get_all_segments_with_tags(
-        original_text, segmentation_data, durchen_data=durchen_data
+        original_text, segmentation_data, durchen_annotation=durchen_data
     )
     
     # First segment [0, 20] - tag at position 0 should be EXCLUDED
-    assert segments[0]["id"] == "seg1"
-    assert '<sup class="footnote-marker"></sup><i class="footnote">At seg1 start</i>' not in segments[0]["content"]
-    assert '<sup class="footnote-marker"></sup><i class="footnote">After seg1 start</i>' in segments[0]["content"]
+    assert segments[0].id == "seg1"
+    assert '<sup class="footnote-marker"></sup><i class="footnote">At seg1 start</i>' not in segments[0].content
+    assert '<sup class="footnote-marker"></sup><i class="footnote">After seg1 start</i>' in segments[0].content
     
     # Second segment [20, 40] - tag at position 20 should be EXCLUDED
-    assert segments[1]["id"] == "seg2"
-    assert '<sup class="footnote-marker"></sup><i class="footnote">At seg2 start</i>' not in segments[1]["content"]
-    assert '<sup class="footnote-marker"></sup><i class="footnote">After seg2 start</i>' in segments[1]["content"]
+    assert segments[1].id == "seg2"
+    assert '<sup class="footnote-marker"></sup><i class="footnote">At seg2 start</i>' not in segments[1].content
+    assert '<sup class="footnote-marker"></sup><i class="footnote">After seg2 start</i>' in segments[1].content
+
+
+def test_get_all_segments_with_tags_unsorted_segments():
+    """Test that unsorted or overlapping segments keep their order and tags."""
+    original_text = "I have a dream to become the world best singer"
+    
+    durchen_data = [
+        {"span": {"start": 0, "end": 10}, "note": "A"},
+        {"span": {"start": 20, "end": 30}, "note": "B"},
+    ]
+    
+    segmentation_data = [
+        {"id": "seg2", "span": {"start": 20, "end": 40}},
+        {"id": "seg1", "span": {"start": 0, "end": 20}},
+        {"id": "seg3", "span": {"start": 5, "end": 35}},
+    ]
+    
+    segments = get_all_segments_with_tags(
+        original_text, segmentation_data, durchen_annotation=durchen_data
+    )
+    
+    assert [segment.id for segment in segments] == ["seg2", "seg1", "seg3"]
+    assert segments[0].content == (
+        original_text[20:30]
+        + '<sup class="footnote-marker"></sup><i class="footnote">B</i>'
+        + original_text[30:40]
+    )
+    assert segments[1].content == (
+        original_text[0:10]
+        + '<sup class="footnote-marker"></sup><i class="footnote">A</i>'
+        + original_text[10:20]
+    )
+    assert '<sup class="footnote-marker"></sup><i class="footnote">A</i>' in segments[2].content
+    assert '<sup class="footnote-marker"></sup><i class="footnote">B</i>' in segments[2].content
+
+
+def test_find_ranges():
+    """Test finding tag index ranges for each segment."""
+    positions = [0, 5, 10, 20, 30]
+    
+    lo, hi = _fast.find_ranges(positions, [0, 10, 35], [15, 30, 40])
+    
+    assert lo == [1, 3, 5]
+    assert hi == [3, 5, 5]
 
+
+def test_find_ranges_numba_matches_bisect(monkeypatch):
+    """Test that the Numba kernel gives the same ranges as the bisect fallback."""
+    pytest.importorskip("numba")
+    
+    cases = [
+        ([0, 5, 10, 20, 30], [0, 10, 35, 5], [15, 30, 40, 5]),
+        ([], [0, 10], [5, 20]),
+    ]
+    
+    for positions, starts, ends in cases:
+        expected = _fast.find_ranges(positions, starts, ends)
+        monkeypatch.setattr(_fast, "NUMBA_MIN_SEGMENTS", 0)
+        assert _fast.find_ranges(positions, starts, ends) == expected
+        monkeypatch.undo()
+
+
+def test_iter_all_segments_with_tags():
+    """Test that the streaming variant yields the same segments lazily."""
+    original_text = "I have a dream to become the world best singer"
+    
+    durchen_data = [
+        {"span": {"start": 0, "end": 10}, "note": "A"},
+        {"span": {"start": 20, "end": 30}, "note": "B"},
+    ]
+    
+    segmentation_data = [
+        {"id": "seg1", "span": {"start": 0, "end": 20}},
+        {"id": "seg2", "span": {"start": 20, "end": 40}},
+    ]
+    
+    segments = iter_all_segments_with_tags(
+        original_text, segmentation_data, durchen_annotation=durchen_data
+    )
+    
+    assert not isinstance(segments, list)
+    assert list(segments) == get_all_segments_with_tags(
+        original_text, segmentation_data, durchen_annotation=durchen_data
+    )
+
+
+def test_get_all_segments_with_tags_parallel(monkeypatch):
+    """Test that splitting segments across worker processes gives the same result."""
+    original_text = "I have a dream to become the world best singer"
+    
+    durchen_data = [
+        {"span": {"start": 0, "end": 10}, "note": "A"},
+        {"span": {"start": 20, "end": 30}, "note": "B"},
+        {"span": {"start": 0, "end": 45}, "note": "C"},
+    ]
+    
+    segmentation_data = [
+        {"id": "seg1", "span": {"start": 0, "end": 15}},
+        {"id": "seg2", "span": {"start": 15, "end": 25}},
+        {"id": "seg3", "span": {"start": 25, "end": 35}},
+        {"id": "seg4", "span": {"start": 35, "end": 46}},
+    ]
+    
+    expected = get_all_segments_with_tags(
+        original_text, segmentation_data, durchen_annotation=durchen_data
+    )
+    monkeypatch.setattr(annotation, "PARALLEL_MIN_SEGMENTS", 0)
+    segments = get_all_segments_with_tags(
+        original_text, segmentation_data, durchen_annotation=durchen_data, workers=3
+    )
+    
+    assert segments == expected
+
+
+def test_get_all_segments_with_tags_rejects_inverted_span():
+    """Test that a segment whose start is after its end is rejected up front."""
+    original_text = "I have a dream"
+    
+    segmentation_data = [
+        {"id": "seg1", "span": {"start": 0, "end": 5}},
+        {"id": "seg2", "span": {"start": 10, "end": 5}},
+    ]
+    
+    with pytest.raises(ValueError):
+        get_all_segments_with_tags(original_text, segmentation_data, durchen_annotation=[])
+    
+    with pytest.raises(ValueError):
+        get_segment_with_tags(original_text, ([], []), 10, 5)